@@ -2,18 +2,59 @@ import argparse
 import subprocess
 from pathlib import Path
 
-from src.process import process_json
-from src.cleaner import data_pipeline
-from src.reports import report_pipeline
+# each command imports only the stages it runs, so a single
+# report doesn't pay for loading the whole geospatial stack
+report_names = ['bike_details', 'daily_trips', 'neighborhood_trips', 'ward_trips',
+                'od_rollups', 'line_tiles', 'make_lines']
+
+def fraction(value):
+    value = float(value)
+    if not 0 < value <= 1:
+        raise argparse.ArgumentTypeError('sample must be between 0 and 1')
+    return value
 
 def get_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-p', '--provider', dest='provider', required=True, 
+    parser.set_defaults(sample=None)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # options shared by every command
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-p', '--provider', dest='provider', required=True,
                         help='choose providers: jump | bird | lime | veoride | spin')
-    parser.add_argument('-t', '--test', dest='test', action='store_true', default=False, 
-                        help='runs a small sample test of 2,000 files through the pipeline.')
-    parser.add_argument('-s', '--sync', dest='sync', action='store_true', default=False,
-                        help='pass this to sync the s3 bucket with new data.')
+
+    # options for commands that read or write the pipeline outputs
+    sampled = argparse.ArgumentParser(add_help=False)
+    sampled.add_argument('--sample', dest='sample', type=fraction, default=None, metavar='FRACTION',
+                         help='run on a fixed sample of bike_ids and scale the report counts up, e.g. 0.1')
+
+    # options for commands that read the raw files
+    raw = argparse.ArgumentParser(add_help=False)
+    raw.add_argument('-t', '--test', dest='test', action='store_true', default=False,
+                     help='runs a small sample test of 2,000 files through the pipeline.')
+
+    commands.add_parser('sync', parents=[common],
+                        help='sync the s3 bucket with new data.')
+    commands.add_parser('ingest', parents=[common, sampled, raw],
+                        help='combine raw json -> combined_snapshots.parquet')
+    commands.add_parser('clean', parents=[common, sampled],
+                        help='make trips from snapshots -> clean_trips_unrouted.parquet')
+    commands.add_parser('route', parents=[common, sampled],
+                        help='route trips -> clean_trips.csv, clean_trips.parquet & trip_store/')
+    commands.add_parser('availability', parents=[common, sampled],
+                        help='count vehicle status per neighborhood from combined_snapshots.parquet')
+    report = commands.add_parser('report', parents=[common, sampled],
+                                 help='make reports from clean_trips.parquet')
+    report.add_argument('-o', '--only', dest='only', nargs='+', default=None,
+                        choices=report_names, metavar='REPORT',
+                        help=f'run only these reports: {" | ".join(report_names)}')
+    commands.add_parser('serve', parents=[common, sampled],
+                        help='serve the trip store on http://127.0.0.1:8990/trips')
+
+    run = commands.add_parser('run', parents=[common, sampled, raw],
+                              help='run every stage of the pipeline.')
+    run.add_argument('-s', '--sync', dest='sync', action='store_true', default=False,
+                     help='pass this to sync the s3 bucket with new data.')
 
     args = parser.parse_args()
     return args
@@ -29,21 +70,104 @@ def provider_folder(prov):
     }
     return map_folder[prov]
 
+def output_folder(prov, sample):
+    # samples are kept apart so they never overwrite the full outputs
+    if sample is None:
+        return prov
+    return f'{prov}/sample-{sample}'
+
+def artifact(prov, name):
+    # intermediate files passed between commands
+    files = {
+        'snapshots': 'combined_snapshots.parquet',
+        'unrouted': 'clean_trips_unrouted.parquet',
+        'trips': 'clean_trips.parquet'
+    }
+    return Path(f'./data/clean/{prov}/{files[name]}')
+
+def sync(prov):
+    # download all new files from s3
+    print('[status] syncing new files', end='\r')
+    cmd = f'cmd.exe /c aws s3 sync s3://{prov} ./data/raw/{prov}'
+    proc = subprocess.Popen(cmd, shell=True)
+    proc.wait()
+
+def ingest(prov, out, test, sample=None):
+    from src.process import process_json
+
+    df = process_json(prov, test, sample=sample)
+    df.to_parquet(artifact(out, 'snapshots'), index=False)
+    return df
+
+def clean(prov, df=None):
+    import pandas as pd
+    from src.cleaner import clean_pipeline
+
+    if df is None:
+        df = pd.read_parquet(artifact(prov, 'snapshots'))
+    df = clean_pipeline(df)
+    df.to_parquet(artifact(prov, 'unrouted'), index=False)
+    return df
+
+def route(prov, df=None, sample=None):
+    import pandas as pd
+    from src.cleaner import route_pipeline
+
+    if df is None:
+        df = pd.read_parquet(artifact(prov, 'unrouted'))
+    df = route_pipeline(df, prov, sample)
+    df.to_parquet(artifact(prov, 'trips'), index=False)
+    return df
+
+def availability(prov, df=None, sample=None):
+    import pandas as pd
+    from src.availability import fleet_availability
+
+    if df is None:
+        df = pd.read_parquet(artifact(prov, 'snapshots'))
+    return fleet_availability(df, prov, sample=sample)
+
+def report(prov, df=None, only=None, sample=None):
+    import pandas as pd
+    from src.reports import report_pipeline
+
+    if df is None:
+        df = pd.read_parquet(artifact(prov, 'trips'))
+    return report_pipeline(df, prov, only, sample)
+
+def serve(prov):
+    from src.store import serve_trip_store
+
+    serve_trip_store(prov)
+
 if __name__ == "__main__":
     args = get_args()
 
     # load provier and create folders
     prov = provider_folder(args.provider)
-    Path(f'./data/clean/{prov}/').mkdir(parents=True, exist_ok=True)
+    out = output_folder(prov, args.sample)
+    Path(f'./data/clean/{out}/').mkdir(parents=True, exist_ok=True)
 
-    # download all new files from s3
-    if args.sync == True:
-        print('[status] syncing new files', end='\r')
-        cmd = f'cmd.exe /c aws s3 sync s3://{prov} ./data/raw/{prov}'
-        proc = subprocess.Popen(cmd, shell=True)
-        proc.wait()
-
-    # join data and run the pipeline
-    df = process_json(prov, args.test)
-    df = data_pipeline(df, prov)
-    df = report_pipeline(df, prov)
\ No newline at end of file
+    if args.command == 'sync':
+        sync(prov)
+    elif args.command == 'ingest':
+        ingest(prov, out, args.test, args.sample)
+    elif args.command == 'clean':
+        clean(out)
+    elif args.command == 'route':
+        route(out, sample=args.sample)
+    elif args.command == 'availability':
+        availability(out, sample=args.sample)
+    elif args.command == 'report':
+        report(out, only=args.only, sample=args.sample)
+    elif args.command == 'serve':
+        serve(out)
+    elif args.command == 'run':
+        # join data and run the pipeline
+        if args.sync == True:
+            sync(prov)
+        df = ingest(prov, out, args.test, args.sample)
+        df = availability(out, df, args.sample)
+        df = clean(out, df)
+        df = route(out, df, args.sample)
+        df = report(out, df, sample=args.sample)
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from src.logger import log_pipeline
+from src.sample import scale_totals
+
+# length of a time slot in seconds
+slot_size = 300
+
+def label_points(lon, lat, polygons, names):
+    """ finds the polygon each point falls in without making point geometries
+
+    vehicles sit still for most snapshots, so only the unique locations
+    are tested and the labels are broadcast back to every row.
+
+    Returns:
+        numpy array of polygon names, None when outside every polygon
+    """
+    # pack coordinates (to ~1cm) into one int so they can be hashed
+    x_int = np.round((lon + 180.0) * 1e7).astype(np.int64)
+    y_int = np.round((lat + 90.0) * 1e7).astype(np.int64)
+    inverse, keys = pd.factorize((x_int << 31) | y_int)
+    x = (keys >> 31) / 1e7 - 180.0
+    y = (keys & 0x7FFFFFFF) / 1e7 - 90.0
+
+    labels = np.full(len(keys), -1)
+    for i, polygon in enumerate(polygons):
+        # skip points outside the polygon's bounding box
+        min_x, min_y, max_x, max_y = polygon.bounds
+        near = np.flatnonzero((labels == -1) & (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y))
+
+        shapely.prepare(polygon)
+        inside = shapely.contains_xy(polygon, x[near], y[near])
+        labels[near[inside]] = i
+
+    names = np.array(list(names) + [None], dtype=object)
+    return names[labels[inverse]]
+
+def battery_level(df):
+    # battery as a 0 - 1 float, jump reports it as "42%"
+    for col in ['jump_ebike_battery_level', 'battery']:
+        if col in list(df):
+            # parse each distinct value once
+            codes, values = pd.factorize(df[col])
+            values = pd.Series(values).astype(str).str.strip()
+            level = pd.to_numeric(values.str.rstrip('%'), errors='coerce').to_numpy()
+
+            # only percentages are rescaled, "1%" is 0.01 not a full battery
+            percent = values.str.endswith('%').to_numpy()
+            level = np.append(np.where(percent, level / 100.0, level), np.nan)
+            return level[codes]
+
+    return np.full(len(df), np.nan)
+
+def snapshot_seconds(df):
+    # veoride reports milliseconds
+    ts = pd.to_numeric(df['timestamp']).to_numpy(dtype=np.int64)
+    return np.where(ts > 1e11, ts // 1000, ts)
+
+def flag(df, col):
+    if col not in list(df):
+        return np.zeros(len(df), dtype=bool)
+    return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy() > 0
+
+@log_pipeline
+def fleet_availability(df, provider, low_battery=0.2, sample=None):
+    """ counts idle, reserved, disabled & low battery vehicles per neighborhood every 5 minutes
+
+    Args:
+        df: combined snapshots from process_json
+        provider: provider folder name
+        low_battery: battery level below which a vehicle counts as low
+        sample: fraction of bikes the snapshots were sampled from
+    """
+    mask = gpd.read_file('./data/files/neighborhoods.geojson')
+    neighbor = label_points(
+        pd.to_numeric(df['lon']).to_numpy(dtype=float),
+        pd.to_numeric(df['lat']).to_numpy(dtype=float),
+        mask['geometry'].values,
+        mask['lname']
+    )
+
+    # keep only the last snapshot in each slot so none are counted twice
+    ts = snapshot_seconds(df)
+    slot = ts // slot_size * slot_size
+    last = pd.Series(ts).groupby(slot).transform('max').to_numpy()
+    keep = ts == last
+
+    disabled = flag(df, 'is_disabled')
+    reserved = flag(df, 'is_reserved') & ~disabled
+    status = pd.DataFrame({
+        'slot': slot,
+        'neghbor': neighbor,
+        'idle': ~(disabled | reserved),
+        'reserved': reserved,
+        'disabled': disabled,
+        'low_battery': battery_level(df) < low_battery
+    })[keep]
+
+    counts = status.groupby(['slot', 'neghbor'], dropna=False).agg(
+        idle=('idle', 'sum'),
+        reserved=('reserved', 'sum'),
+        disabled=('disabled', 'sum'),
+        low_battery=('low_battery', 'sum'),
+        total=('idle', 'size')
+    )
+
+    # every neighborhood (and outside of them) gets a row in every slot,
+    # even when it has no vehicles
+    every = pd.MultiIndex.from_product(
+        [np.unique(slot[keep]), list(mask['lname']) + [None]],
+        names=['slot', 'neghbor']
+    )
+    counts = counts.reindex(every, fill_value=0).reset_index()
+    counts['slot'] = pd.to_datetime(counts['slot'], unit='s')
+
+    # a vehicle is counted once per slot, so the sum of squares is the count
+    if sample is not None:
+        for col in ['idle', 'reserved', 'disabled', 'low_battery', 'total']:
+            counts[col], counts[f'{col}_low'], counts[f'{col}_high'] = scale_totals(counts[col], counts[col], sample)
+
+    counts.to_csv(f'./data/clean/{provider}/report_fleet_availability.csv', index=False)
+
+    return df
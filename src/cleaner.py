@@ -1,12 +1,15 @@
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point
-from geopy.distance import distance
 
 from src.logger import log_pipeline
-from src.router import routing_pipeline
+
+# the route stage imports (geopy, router, store & tiles) are loaded in the
+# functions that use them so the clean command doesn't pay for them
 
 def straight_distance(row):
+    from geopy.distance import distance
+
     start = (row['lat_start'], row['lon_start'])
     end = (row['lat_end'], row['lon_end'])
     dist = distance(start, end).m
@@ -240,20 +243,28 @@ def get_estimate_speed(df):
 
 @log_pipeline
 def routing_details(df):
+    from src.router import routing_pipeline
+
     routed = routing_pipeline(df, 'json', 'car', 30)
     df = df.merge(routed, how='left', on='trip_id')
 
     return df
 
 @log_pipeline
-def make_gpx_routes(df, provider):
+def make_gpx_routes(df, provider, sample=None):
+    from src.router import routing_pipeline
+    from src.tiles import build_mbtiles
+
     file_path = f'./data/clean/{provider}/clean_bike_routes.geojson'
     gdf = routing_pipeline(df, 'gpx', 'car', 30)
     gdf.to_file(file_path, driver='GeoJSON')
 
+    tile_path = f'./data/clean/{provider}/clean_bike_routes.mbtiles'
+    build_mbtiles(gdf.geometry.values, tile_path, 'routes', sample=sample)
+
     return df
 
-def data_pipeline(df, provider):
+def clean_pipeline(df):
     clean = (df
         .pipe(start_pipeline, copy=False)
         .pipe(make_trips)
@@ -270,13 +281,21 @@ def data_pipeline(df, provider):
         .pipe(drop_geom)
         .pipe(classify_battery)
         .pipe(get_duration)
+    )
+
+    return clean
+
+def route_pipeline(df, provider, sample=None):
+    from src.store import build_trip_store
+
+    clean = (df
         .pipe(routing_details)
         .pipe(missing_distance)
         .pipe(get_estimate_speed)
-        .pipe(make_gpx_routes, provider)
+        .pipe(make_gpx_routes, provider, sample)
+        .pipe(build_trip_store, provider)
     )
 
     file_path = f'./data/clean/{provider}/clean_trips.csv'
     clean.to_csv(file_path, index=False)
     return clean
-
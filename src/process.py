@@ -7,12 +7,15 @@ from pathlib import Path
 from queue import Queue
 from threading import Thread
 
+from src.sample import sample_bikes
+
 frames = []
 
 class process_worker(Thread):
-    def __init__(self, queue):
+    def __init__(self, queue, sample=None):
         Thread.__init__(self)
         self.queue = queue
+        self.sample = sample
 
     def run(self):
         while True:
@@ -22,7 +25,7 @@ class process_worker(Thread):
             
             try:
                 # input json file
-                df = convert_json(file)
+                df = convert_json(file, self.sample)
                 frames.append(df)
                 
             except:
@@ -47,24 +50,28 @@ def clean_columns(df):
 
     return df
 
-def convert_json(file):
+def convert_json(file, sample=None):
     with open(file) as f:
         data = json.load(f)
 
     df = pd.json_normalize(data['data']['bikes'])
     df = clean_columns(df)
     df['timestamp'] = data['last_updated']
+
+    # keep only the sampled bikes
+    if sample is not None:
+        df = sample_bikes(df, sample)
     
     return df
 
-def combine_json(files, workers):
+def combine_json(files, workers, sample=None):
 
     # Create a queue to communicate with the worker threads
     queue = Queue()
 
     # Create worker threads
     for x in range(workers):   
-        worker = process_worker(queue)
+        worker = process_worker(queue, sample)
         worker.daemon = True
         worker.start()
 
@@ -91,13 +98,13 @@ def veh_type(provider):
     else:
         return 'bikes'
 
-def process_json(provider, test=False, workers=100):   
+def process_json(provider, test=False, workers=100, sample=None):   
     # load data
     files = list(Path(f'./data/raw/{provider}/{veh_type(provider)}/').glob('*.json'))
 
     if test:
         files = files[:2000]
-    df = combine_json(files, workers)
+    df = combine_json(files, workers, sample)
     
     # spin changed their id, this filters out older ones
     if provider == 'spin-scooters':
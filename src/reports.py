@@ -1,9 +1,9 @@
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely import wkt
-from shapely.geometry import Point, LineString
 
 from src.logger import log_pipeline
+from src.rollups import od_rollups
+from src.sample import scale_counts
 
 def daily_weather(df):
     rename_cols = {
@@ -20,27 +20,39 @@ def daily_weather(df):
     return df
 
 @log_pipeline
-def neighborhood_trips(df, provider):
+def neighborhood_trips(df, provider, sample=None):
     # get neighborhood start/end and %
-    s1 = df.groupby(['neghbor_start', 'neghbor_end']).size()
+    if sample is None:
+        s1 = df.groupby(['neghbor_start', 'neghbor_end']).size()
+    else:
+        scaled = scale_counts(df, ['neghbor_start', 'neghbor_end'], sample)
+        s1 = scaled['count']
     s2 = (s1 / s1.groupby(level=0).sum())
 
     # combine & save output
     neighbor = pd.concat([s1, s2], axis=1).reset_index()
-    neighbor = neighbor.rename(columns={0:'count', 1:'percent'})
+    neighbor.columns = ['neghbor_start', 'neghbor_end', 'count', 'percent']
+    if sample is not None:
+        neighbor = neighbor.merge(scaled.drop(columns='count').reset_index(), on=['neghbor_start', 'neghbor_end'])
     neighbor.to_csv(f'./data/clean/{provider}/report_neighborhood_trips.csv', index=False)
 
     return df
 
 @log_pipeline
-def ward_trips(df, provider):
+def ward_trips(df, provider, sample=None):
     # get ward start/end and %
-    s1 = df.groupby(['ward_start', 'ward_end']).size()
+    if sample is None:
+        s1 = df.groupby(['ward_start', 'ward_end']).size()
+    else:
+        scaled = scale_counts(df, ['ward_start', 'ward_end'], sample)
+        s1 = scaled['count']
     s2 = (s1 / s1.groupby(level=0).sum())
 
     # combine & save output
     ward = pd.concat([s1, s2], axis=1).reset_index()
-    ward = ward.rename(columns={0:'count', 1:'percent'})
+    ward.columns = ['ward_start', 'ward_end', 'count', 'percent']
+    if sample is not None:
+        ward = ward.merge(scaled.drop(columns='count').reset_index(), on=['ward_start', 'ward_end'])
     ward.to_csv(f'./data/clean/{provider}/report_ward_trips.csv', index=False)
 
     return df
@@ -71,12 +83,16 @@ def bike_details(df, provider):
     return df
 
 @log_pipeline
-def daily_trips(df, weather, provider):
+def daily_trips(df, weather, provider, sample=None):
     # filter just trips (no long/charge)
     trips = df[df['type'] == 'trip']
 
     # total daily trips
-    daily_trips = trips.groupby(trips['timestamp_start'].dt.date)['trip_id'].count().reset_index()
+    if sample is None:
+        daily_trips = trips.groupby(trips['timestamp_start'].dt.date)['trip_id'].count().reset_index()
+    else:
+        trips = trips.assign(timestamp_start=trips['timestamp_start'].dt.date)
+        daily_trips = scale_counts(trips, ['timestamp_start'], sample, name='trip_id').reset_index()
 
     # rename column and set date format
     daily_trips = daily_trips.rename(columns={'timestamp_start':'date'})
@@ -88,8 +104,28 @@ def daily_trips(df, weather, provider):
 
     return df
 
+@log_pipeline
+def line_tiles(df, provider, sample=None):
+    # imported here so the other reports don't load the spatial stack
+    import shapely
+    from src.tiles import build_mbtiles
+
+    # straight line from start to end of each trip
+    start = df[['lon_start', 'lat_start']].astype(float).to_numpy()
+    end = df[['lon_end', 'lat_end']].astype(float).to_numpy()
+    lines = shapely.linestrings(np.stack([start, end], axis=1))
+
+    file_path = f'./data/clean/{provider}/report_trip_lines_straight.mbtiles'
+    build_mbtiles(lines, file_path, 'trip_lines', sample=sample)
+
+    return df
+
 @log_pipeline
 def make_lines(df, provider):
+    import geopandas as gpd
+    from shapely import wkt
+    from shapely.geometry import Point, LineString
+
     for i, row in df.iterrows():
         start = Point(row['lon_start'], row['lat_start'])
         end = Point(row['lon_end'], row['lat_end'])
@@ -108,18 +144,30 @@ def make_lines(df, provider):
     
     return df
 
-def report_pipeline(df, prov):
+def report_pipeline(df, prov, only=None, sample=None):
+    """ runs every report, or just the names listed in only
+
+    when the trips are a sample of bikes, pass the sample fraction so
+    counts are scaled up to the full fleet.
+    """
 
     # get the daily weather data
     weather = pd.read_csv('./data/files/daily_weather.csv')
     weather = daily_weather(weather)
 
-    report = (df
-        .pipe(bike_details, prov)
-        .pipe(daily_trips, weather, prov)
-        .pipe(neighborhood_trips, prov)
-        .pipe(ward_trips, prov)
-        .pipe(make_lines, prov)
-    )
-
-    return report
\ No newline at end of file
+    reports = [
+        (bike_details, [prov]),
+        (daily_trips, [weather, prov, sample]),
+        (neighborhood_trips, [prov, sample]),
+        (ward_trips, [prov, sample]),
+        (od_rollups, [weather, prov, sample]),
+        (line_tiles, [prov, sample]),
+        (make_lines, [prov])
+    ]
+
+    report = df
+    for func, args in reports:
+        if only is None or func.__name__ in only:
+            report = report.pipe(func, *args)
+
+    return report
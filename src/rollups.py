@@ -0,0 +1,131 @@
+import pandas as pd
+from pathlib import Path
+
+from src.logger import log_pipeline
+
+# origin/destination columns for each rollup level
+rollup_levels = {
+    'neighborhood': ['neghbor_start', 'neghbor_end'],
+    'ward': ['ward_start', 'ward_end']
+}
+
+weather_cols = ['avg_wind', 'precipitation', 'max_temp']
+
+def rollup_path(provider, level):
+    return Path(f'./data/clean/{provider}/rollup_{level}_trips.parquet')
+
+def build_rollup(df, weather, level, sample=None):
+    """ groups trips into an hourly origin/destination cube
+
+    Args:
+        df: clean trips with timestamp_start, type & od columns
+        weather: daily weather with a m/d/Y date column
+        level: "neighborhood" or "ward"
+        sample: fraction of bikes the trips were sampled from, totals are scaled by it
+
+    Returns:
+        pandas dataframe with one row per date, hour, od pair and type
+    """
+    origin, dest = rollup_levels[level]
+    start = pd.to_datetime(df['timestamp_start'])
+
+    trips = pd.DataFrame({
+        'date': start.dt.normalize(),
+        'hour': start.dt.hour.astype('int8'),
+        'weekday': start.dt.dayofweek.astype('int8'),
+        'origin': df[origin].astype(str).where(df[origin].notnull()),
+        'destination': df[dest].astype(str).where(df[dest].notnull()),
+        'type': df['type'],
+        'duration_min': df['duration_min'],
+        'distance': df['distance']
+    })
+
+    keys = ['date', 'hour', 'weekday', 'origin', 'destination', 'type']
+    cube = trips.groupby(keys, dropna=False).agg(
+        count=('type', 'size'),
+        duration_min=('duration_min', 'sum'),
+        distance=('distance', 'sum')
+    ).reset_index()
+
+    # scale sampled totals up to the full fleet
+    if sample is not None:
+        for col in ['count', 'duration_min', 'distance']:
+            cube[col] = cube[col] / sample
+
+    # attach the weather for the day the trip started
+    weather = weather.copy()
+    weather['date'] = pd.to_datetime(weather['date'], format='%m/%d/%Y')
+    cube = cube.merge(weather[['date'] + weather_cols], how='left', on='date')
+
+    # low cardinality text columns are stored as dictionaries
+    for col in ['origin', 'destination', 'type']:
+        cube[col] = cube[col].astype('category')
+
+    return cube.sort_values(keys).reset_index(drop=True)
+
+@log_pipeline
+def od_rollups(df, weather, provider, sample=None):
+    # save a cube for each level, sorted by date so row groups prune on time
+    for level in rollup_levels:
+        cube = build_rollup(df, weather, level, sample)
+        cube.to_parquet(rollup_path(provider, level), index=False, row_group_size=50000)
+
+    return df
+
+def build_filters(filters):
+    """ converts keyword filters into parquet predicates
+
+    a scalar matches exactly, a list matches any of its values and a
+    tuple of (low, high) matches an inclusive range, either end can be None.
+    """
+    predicates = []
+    for col, value in filters.items():
+        if col == 'date':
+            if isinstance(value, tuple):
+                value = tuple(None if v is None else pd.Timestamp(v) for v in value)
+            elif isinstance(value, list):
+                value = [pd.Timestamp(v) for v in value]
+            else:
+                value = pd.Timestamp(value)
+
+        if isinstance(value, tuple):
+            low, high = value
+            if low is not None:
+                predicates.append((col, '>=', low))
+            if high is not None:
+                predicates.append((col, '<=', high))
+        elif isinstance(value, (list, set)):
+            predicates.append((col, 'in', list(value)))
+        else:
+            predicates.append((col, '==', value))
+
+    return predicates
+
+def query_rollup(provider, level='ward', by=None, **filters):
+    """ answers slice & dice questions from a saved od rollup
+
+    example: ward 1 to ward 5 trips on rainy weekday evenings
+        query_rollup('pvd-jump-bikes', 'ward', by=['date'], origin='1', destination='5',
+                     weekday=(0, 4), hour=(17, 21), precipitation=(0.01, None))
+
+    Args:
+        provider: provider folder name
+        level: "neighborhood" or "ward"
+        by: columns to group the matching rows by, None returns the totals
+        filters: column=value pairs, see build_filters
+
+    Returns:
+        pandas dataframe with count, duration_min and distance totals
+    """
+    predicates = build_filters(filters)
+    cube = pd.read_parquet(rollup_path(provider, level), filters=predicates or None)
+
+    totals = ['count', 'duration_min', 'distance']
+    if by is None:
+        return cube[totals].sum().to_frame().T
+
+    if isinstance(by, str):
+        by = [by]
+    result = cube.groupby(by, observed=True, dropna=False)[totals].sum()
+
+    return result.reset_index()
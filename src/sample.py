@@ -0,0 +1,52 @@
+import zlib
+import numpy as np
+import pandas as pd
+
+# z score for a 95% confidence interval
+z_score = 1.96
+
+def in_sample(bike_id, fraction):
+    """ picks the same bikes on every run by hashing the bike_id
+
+    python's hash() changes between runs so crc32 is used instead.
+    """
+    bucket = zlib.crc32(str(bike_id).encode('utf-8')) / 2**32
+    return bucket < fraction
+
+def sample_bikes(df, fraction):
+    # hash each distinct bike once, not every snapshot row
+    codes, bikes = pd.factorize(df['bike_id'])
+    keep = np.array([in_sample(b, fraction) for b in bikes] + [False])
+    return df[keep[codes]]
+
+def scale_totals(total, sum_sq, fraction):
+    """ scales sampled totals back up with a 95% confidence interval
+
+    every bike is kept with probability = fraction, so the estimate is
+    total / fraction with variance (1 - fraction) / fraction^2 * sum(y^2)
+    where y is each sampled bike's contribution to the total.
+
+    Returns:
+        estimate, low, high
+    """
+    estimate = total / fraction
+    error = z_score * np.sqrt((1 - fraction) / fraction**2 * sum_sq)
+
+    # can't be lower than what was actually seen
+    low = np.maximum(estimate - error, total)
+    high = estimate + error
+
+    return estimate.round(1), low.round(1), high.round(1)
+
+def scale_counts(df, keys, fraction, name='count'):
+    """ counts rows by keys and scales them to the full fleet
+
+    Returns:
+        pandas dataframe indexed by keys with name, name_low & name_high
+    """
+    per_bike = df.groupby(keys + ['bike_id']).size()
+    total = per_bike.groupby(level=keys).sum()
+    sum_sq = (per_bike ** 2).groupby(level=keys).sum()
+    estimate, low, high = scale_totals(total, sum_sq, fraction)
+
+    return pd.DataFrame({name: estimate, f'{name}_low': low, f'{name}_high': high})
@@ -0,0 +1,255 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.logger import log_pipeline
+
+# size of a spatial grid cell in degrees (~500m in providence)
+cell_size = 0.005
+
+# trip ends that have a grid index
+points = ('start', 'end')
+
+# rows returned by the http endpoint when no limit is given, and at most
+default_limit = 10000
+max_limit = 100000
+
+def store_path(provider):
+    return Path(f'./data/clean/{provider}/trip_store/')
+
+def grid_cells(lon, lat, meta):
+    # map coordinates onto the grid, clipping anything outside of it
+    col = np.floor((lon - meta['min_lon']) / meta['cell_size']).astype(np.int64)
+    row = np.floor((lat - meta['min_lat']) / meta['cell_size']).astype(np.int64)
+    col = np.clip(col, 0, meta['n_cols'] - 1)
+    row = np.clip(row, 0, meta['n_rows'] - 1)
+
+    return row * meta['n_cols'] + col
+
+def bucket_index(keys, n_buckets):
+    """ builds a lookup from bucket -> rows, like a csr matrix
+
+    Returns:
+        order: row numbers sorted by bucket
+        offsets: rows for bucket i are order[offsets[i]:offsets[i+1]]
+    """
+    order = np.argsort(keys, kind='stable')
+    counts = np.bincount(keys, minlength=n_buckets)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    return order, offsets
+
+@log_pipeline
+def build_trip_store(df, provider):
+    """ saves trips as memory mappable columns with time, bike & grid indexes """
+    path = store_path(provider)
+    path.mkdir(parents=True, exist_ok=True)
+
+    # the time index is the row order itself
+    trips = df.copy()
+    trips['timestamp_start'] = pd.to_datetime(trips['timestamp_start'])
+    trips = trips.sort_values('timestamp_start', kind='stable').reset_index(drop=True)
+
+    # numeric & time columns are saved as is, everything else as codes.
+    # bike_id is always saved as codes, spin & veoride ids are ints
+    meta = {'columns': {}, 'labels': {}, 'size': len(trips)}
+    for col in trips.columns:
+        values = trips[col]
+        numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+        if pd.api.types.is_datetime64_any_dtype(values):
+            arr = values.to_numpy().astype('datetime64[ns]')
+        elif pd.api.types.is_timedelta64_dtype(values):
+            arr = values.to_numpy().astype('timedelta64[ns]')
+        elif numeric and col != 'bike_id':
+            arr = values.to_numpy(dtype=float) if values.isnull().any() else values.to_numpy()
+        else:
+            codes, labels = pd.factorize(values.astype(str).where(values.notnull()))
+            arr = codes.astype(np.int32)
+            meta['labels'][col] = [str(x) for x in labels]
+        np.save(path / f'{col}.npy', arr)
+        meta['columns'][col] = str(arr.dtype)
+
+    # bike_id index
+    bike_codes = np.load(path / 'bike_id.npy')
+    order, offsets = bucket_index(bike_codes, len(meta['labels']['bike_id']))
+    np.save(path / 'bike_order.npy', order)
+    np.save(path / 'bike_offsets.npy', offsets)
+
+    # grid index covering both start & end points
+    lon = np.concatenate([trips['lon_start'], trips['lon_end']]).astype(float)
+    lat = np.concatenate([trips['lat_start'], trips['lat_end']]).astype(float)
+    meta['cell_size'] = cell_size
+    meta['min_lon'] = float(np.nanmin(lon)) if len(lon) else 0.0
+    meta['min_lat'] = float(np.nanmin(lat)) if len(lat) else 0.0
+    meta['n_cols'] = int((np.nanmax(lon) - meta['min_lon']) // cell_size) + 1 if len(lon) else 1
+    meta['n_rows'] = int((np.nanmax(lat) - meta['min_lat']) // cell_size) + 1 if len(lat) else 1
+
+    for point in ['start', 'end']:
+        cells = grid_cells(trips[f'lon_{point}'].to_numpy(float), trips[f'lat_{point}'].to_numpy(float), meta)
+        order, offsets = bucket_index(cells, meta['n_cols'] * meta['n_rows'])
+        np.save(path / f'{point}_cell_order.npy', order)
+        np.save(path / f'{point}_cell_offsets.npy', offsets)
+
+    with open(path / 'meta.json', 'w') as f:
+        json.dump(meta, f)
+
+    return df
+
+class TripStore:
+    """ read-only queries over a saved trip store, columns are memory mapped
+
+    example: trips starting downtown during a week
+        store = TripStore('pvd-jump-bikes')
+        store.query(start='2019-06-01', end='2019-06-08',
+                    bbox=(-71.42, 41.82, -71.40, 41.83))
+    """
+
+    def __init__(self, provider):
+        self.path = store_path(provider)
+        with open(self.path / 'meta.json') as f:
+            self.meta = json.load(f)
+
+        self.columns = {col: self.load(col) for col in self.meta['columns']}
+        self.bike_lookup = {b: i for i, b in enumerate(self.meta['labels']['bike_id'])}
+
+    def load(self, name):
+        return np.load(self.path / f'{name}.npy', mmap_mode='r')
+
+    def time_range(self, start=None, end=None):
+        """ returns the slice of rows with start <= timestamp_start < end """
+        times = self.columns['timestamp_start']
+        lo = 0 if start is None else np.searchsorted(times, np.datetime64(pd.Timestamp(start), 'ns'), 'left')
+        hi = len(times) if end is None else np.searchsorted(times, np.datetime64(pd.Timestamp(end), 'ns'), 'left')
+
+        return int(lo), int(hi)
+
+    def bike_rows(self, bike_id):
+        code = self.bike_lookup.get(str(bike_id))
+        if code is None:
+            return np.array([], dtype=np.int64)
+        offsets = self.load('bike_offsets')
+
+        return np.sort(self.load('bike_order')[offsets[code]:offsets[code + 1]])
+
+    def bbox_rows(self, bbox, point='start'):
+        """ returns rows whose start or end point falls in (min_lon, min_lat, max_lon, max_lat) """
+        if point not in points:
+            raise ValueError('point must be "start" or "end"')
+        min_lon, min_lat, max_lon, max_lat = bbox
+        meta = self.meta
+
+        # candidate cells overlapping the box
+        lo = grid_cells(np.array([min_lon]), np.array([min_lat]), meta)[0]
+        hi = grid_cells(np.array([max_lon]), np.array([max_lat]), meta)[0]
+        lo_row, lo_col = divmod(lo, meta['n_cols'])
+        hi_row, hi_col = divmod(hi, meta['n_cols'])
+
+        order = self.load(f'{point}_cell_order')
+        offsets = self.load(f'{point}_cell_offsets')
+        chunks = []
+        for row in range(lo_row, hi_row + 1):
+            first = row * meta['n_cols'] + lo_col
+            last = row * meta['n_cols'] + hi_col
+            chunks.append(order[offsets[first]:offsets[last + 1]])
+        rows = np.sort(np.concatenate(chunks)) if chunks else np.array([], dtype=np.int64)
+
+        # exact check for points in the edge cells
+        lon = self.columns[f'lon_{point}'][rows]
+        lat = self.columns[f'lat_{point}'][rows]
+        inside = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+
+        return rows[inside]
+
+    def query(self, start=None, end=None, bike_id=None, bbox=None, point='start', limit=None):
+        """ finds trips matching every filter given
+
+        Args:
+            start, end: timestamp_start range, end is exclusive
+            bike_id: a single bike
+            bbox: (min_lon, min_lat, max_lon, max_lat)
+            point: match the bbox on the "start" or "end" of the trip
+            limit: max number of trips to return
+
+        Returns:
+            pandas dataframe of trips ordered by timestamp_start
+        """
+        if point not in points:
+            raise ValueError('point must be "start" or "end"')
+
+        lo, hi = self.time_range(start, end)
+        rows = None
+        if bike_id is not None:
+            rows = self.bike_rows(bike_id)
+        if bbox is not None:
+            found = self.bbox_rows(bbox, point)
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+
+        if rows is None:
+            rows = np.arange(lo, hi)
+        else:
+            rows = rows[(rows >= lo) & (rows < hi)]
+        if limit is not None:
+            rows = rows[:limit]
+
+        return self.rows(rows)
+
+    def rows(self, rows):
+        data = {}
+        for col, arr in self.columns.items():
+            values = arr[rows]
+            if col in self.meta['labels']:
+                labels = np.array(self.meta['labels'][col] + [None], dtype=object)
+                values = labels[values]
+            data[col] = values
+
+        return pd.DataFrame(data)
+
+class TripStoreHandler(BaseHTTPRequestHandler):
+    """ GET /trips?start=&end=&bike_id=&bbox=min_lon,min_lat,max_lon,max_lat&point=&limit=
+
+    limit defaults to default_limit and is capped at max_limit.
+    """
+    store = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/trips':
+            self.send_error(404)
+            return
+
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            bbox = params.get('bbox')
+            if bbox is not None:
+                bbox = tuple(float(x) for x in bbox.split(','))
+            limit = int(params.get('limit', default_limit))
+            if limit < 0:
+                raise ValueError("limit can't be negative")
+            trips = self.store.query(
+                start=params.get('start'),
+                end=params.get('end'),
+                bike_id=params.get('bike_id'),
+                bbox=bbox,
+                point=params.get('point', 'start'),
+                limit=min(limit, max_limit)
+            )
+        except Exception:
+            # don't echo the error, it can include file paths
+            self.send_error(400, 'invalid query parameters')
+            return
+
+        body = trips.to_json(orient='records', date_format='iso').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_trip_store(provider, host='127.0.0.1', port=8990):
+    TripStoreHandler.store = TripStore(provider)
+    server = ThreadingHTTPServer((host, port), TripStoreHandler)
+    print(f'[status] serving trip store on http://{host}:{port}/trips')
+    server.serve_forever()
@@ -0,0 +1,187 @@
+import gzip
+import json
+import sqlite3
+import numpy as np
+import shapely
+import mapbox_vector_tile
+
+# for multi-processing
+from multiprocessing import Pool
+
+# tile size in tile units & how much to draw past the tile edge
+extent = 4096
+buffer = 64
+
+# segments are snapped to this many tile units (1px on a 256px tile) from
+# detail_zoom up, each zoom below it doubles the snap so lines merge into flows
+snap = 16
+detail_zoom = 13
+
+# most segments kept in a tile, the lowest counts are dropped past it
+max_segments = 2000
+
+def world_pixels(lon, lat, zoom):
+    # web mercator coordinates in tile units for the zoom level
+    size = extent * 2 ** zoom
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = (lon + 180.0) / 360.0 * size
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * size
+
+    return x, y
+
+def zoom_snap(zoom):
+    return snap * 2 ** max(0, detail_zoom - zoom)
+
+def zoom_segments(geoms, zoom):
+    """ simplifies lines for a zoom and counts the overlapping segments
+
+    Args:
+        geoms: array of shapely linestrings in epsg:4326
+        zoom: the zoom level
+
+    Returns:
+        segments: (n, 4) array of x0, y0, x1, y1 in world tile units
+        counts: how many lines use each segment
+    """
+    coords, index = shapely.get_coordinates(geoms, return_index=True)
+    x, y = world_pixels(coords[:, 0], coords[:, 1], zoom)
+
+    # simplify in tile units so each zoom keeps only visible detail
+    grid = zoom_snap(zoom)
+    lines = shapely.linestrings(np.column_stack([x, y]), indices=index)
+    lines = shapely.simplify(lines, grid)
+    coords, index = shapely.get_coordinates(lines, return_index=True)
+    coords = np.round(coords / grid) * grid
+
+    # pair up consecutive points of the same line
+    same = index[1:] == index[:-1]
+    start = coords[:-1][same]
+    end = coords[1:][same]
+
+    # direction doesn't matter when counting overlaps
+    flip = (start[:, 0] > end[:, 0]) | ((start[:, 0] == end[:, 0]) & (start[:, 1] > end[:, 1]))
+    start[flip], end[flip] = end[flip], start[flip]
+    segments = np.column_stack([start, end])
+    segments = segments[(segments[:, 0] != segments[:, 2]) | (segments[:, 1] != segments[:, 3])]
+
+    return np.unique(segments, axis=0, return_counts=True)
+
+def tile_segments(segments, counts, zoom):
+    """ assigns each segment to every tile its bounding box touches
+
+    tiles are limited to the max_segments with the highest counts.
+
+    Returns:
+        dictionary of (zoom, x, y) -> (segments, counts)
+    """
+    last = 2 ** zoom - 1
+    low = np.floor((np.minimum(segments[:, :2], segments[:, 2:]) - buffer) / extent).astype(np.int64)
+    high = np.floor((np.maximum(segments[:, :2], segments[:, 2:]) + buffer) / extent).astype(np.int64)
+    low, high = np.clip(low, 0, last), np.clip(high, 0, last)
+
+    # repeat segments spanning more than one tile
+    n_x = high[:, 0] - low[:, 0] + 1
+    n_y = high[:, 1] - low[:, 1] + 1
+    repeat = n_x * n_y
+    seg = np.repeat(np.arange(len(segments)), repeat)
+    step = np.arange(len(seg)) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+    tile_x = low[seg, 0] + step % n_x[seg]
+    tile_y = low[seg, 1] + step // n_x[seg]
+
+    order = np.lexsort([tile_y, tile_x])
+    seg, tile_x, tile_y = seg[order], tile_x[order], tile_y[order]
+    keys = tile_x * (last + 1) + tile_y
+    splits = np.flatnonzero(np.diff(keys)) + 1
+
+    tiles = {}
+    for group in np.split(np.arange(len(seg)), splits):
+        if len(group) == 0:
+            continue
+        if len(group) > max_segments:
+            busiest = np.argsort(-counts[seg[group]], kind='stable')[:max_segments]
+            group = group[busiest]
+        x, y = int(tile_x[group[0]]), int(tile_y[group[0]])
+        local = segments[seg[group]] - np.array([x, y, x, y]) * extent
+        tiles[(zoom, x, y)] = (local, counts[seg[group]])
+
+    return tiles
+
+def encode_tile(task):
+    """ encodes one tile, segments sharing a count are merged into one feature """
+    (zoom, x, y), (segments, counts), layer = task
+
+    lines = shapely.linestrings(segments.reshape(-1, 2, 2))
+    lines = shapely.clip_by_rect(lines, -buffer, -buffer, extent + buffer, extent + buffer)
+    keep = ~shapely.is_empty(lines)
+    lines, counts = lines[keep], counts[keep]
+
+    features = []
+    for count in np.unique(counts):
+        geom = shapely.line_merge(shapely.multilinestrings(lines[counts == count]))
+        features.append({'geometry': geom, 'properties': {'count': count.item()}})
+
+    options = {'y_coord_down': True, 'extents': extent}
+    data = mapbox_vector_tile.encode([{'name': layer, 'features': features}], default_options=options)
+
+    return zoom, x, y, gzip.compress(data)
+
+def write_mbtiles(file_path, tiles, layer, min_zoom, max_zoom, bounds):
+    conn = sqlite3.connect(file_path)
+    conn.execute('DROP TABLE IF EXISTS metadata')
+    conn.execute('DROP TABLE IF EXISTS tiles')
+    conn.execute('CREATE TABLE metadata (name text, value text)')
+    conn.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+
+    vector_layers = [{'id': layer, 'fields': {'count': 'Number'}, 'minzoom': min_zoom, 'maxzoom': max_zoom}]
+    center = [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2, min_zoom]
+    metadata = {
+        'name': layer,
+        'format': 'pbf',
+        'type': 'overlay',
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': ','.join(str(b) for b in bounds),
+        'center': ','.join(str(c) for c in center),
+        'json': json.dumps({'vector_layers': vector_layers})
+    }
+    conn.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+
+    # mbtiles rows are numbered from the bottom (tms)
+    rows = ((z, x, 2 ** z - 1 - y, data) for z, x, y, data in tiles)
+    conn.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', rows)
+    conn.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+    conn.commit()
+    conn.close()
+
+def build_mbtiles(geoms, file_path, layer, min_zoom=10, max_zoom=16, workers=None, sample=None):
+    """ builds a vector tile pyramid of line counts into an mbtiles file
+
+    Args:
+        geoms: array of shapely linestrings in epsg:4326
+        file_path: where to save the .mbtiles file
+        layer: name of the tile layer
+        min_zoom, max_zoom: zoom levels to build
+        workers: processes used to encode tiles, defaults to the cpu count
+        sample: fraction of bikes the lines were sampled from, counts are scaled by it
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    geoms = geoms[~(shapely.is_missing(geoms) | shapely.is_empty(geoms))]
+
+    # no trips (e.g. a small sample), still replace any older tileset
+    if len(geoms) == 0:
+        write_mbtiles(file_path, [], layer, min_zoom, max_zoom, [-180.0, -85.0511, 180.0, 85.0511])
+        return
+
+    bounds = shapely.total_bounds(geoms).tolist()
+
+    def tasks():
+        for zoom in range(min_zoom, max_zoom + 1):
+            segments, counts = zoom_segments(geoms, zoom)
+            if sample is not None:
+                counts = np.round(counts / sample, 1)
+            for key, value in tile_segments(segments, counts, zoom).items():
+                yield key, value, layer
+
+    with Pool(workers) as pool:
+        tiles = pool.imap_unordered(encode_tile, tasks(), chunksize=16)
+        write_mbtiles(file_path, tiles, layer, min_zoom, max_zoom, bounds)